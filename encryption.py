@@ -15,13 +15,13 @@ class AESCipher(object):
 
     @staticmethod
     def str_to_bytes(data):
-        u_type = type(b''.decode('utf8'))
-        if isinstance(data, u_type):
+        if isinstance(data, str):
             return data.encode('utf8')
         return data
 
     def _pad(self, s):
-        return s + (self.bs - len(s) % self.bs) * AESCipher.str_to_bytes(chr(self.bs - len(s) % self.bs))
+        pad_len = self.bs - len(s) % self.bs
+        return s + bytes((pad_len,)) * pad_len
 
     @staticmethod
     def _unpad(s):
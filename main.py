@@ -1,12 +1,18 @@
 
 import getpass
 import hashlib
+import hmac
 
 import os
 import re
+import sys
+import tempfile
 import pyperclip
 import encryption
 
+# Pattern of the login:password line entered in db_append
+LOGIN_PASSWORD_PATTERN = re.compile(r"(?P<login>[^:\s][^:]*[^:\s]):(?P<password>\S.*\S)")
+
 
 def print_help():
     print("""Available commands:
@@ -26,29 +32,105 @@ def get_hash(password):
         print("Password contains unexpected symbols (note that russian lang is not supported)")
 
 
+# Parameters of the scrypt key derivation used for user passwords
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def _scrypt(password, salt):
+    return hashlib.scrypt(password, salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P).hex()
+
+
+# This function calculates the salted hash of the user password which is stored in users.txt
+def hash_user_password(password):
+    salt = os.urandom(16)
+    return "scrypt${}${}".format(salt.hex(), _scrypt(password, salt))
+
+
+# This function checks the entered password against the hash from users.txt
+def check_user_password(user_name, password, stored_hash):
+    if stored_hash.startswith("scrypt$"):
+        # Malformed entry is treated as a wrong password
+        try:
+            _, salt, key = stored_hash.split("$")
+            salt, key = bytes.fromhex(salt), bytes.fromhex(key)
+        except ValueError:
+            return False
+        return hmac.compare_digest(bytes.fromhex(_scrypt(password, salt)), key)
+    # Users registered before scrypt have unsalted sha256 of username and password
+    return hmac.compare_digest(get_hash(user_name.encode("utf-8") + password), stored_hash)
+
+
+# This function writes the file atomically, so it is never left half-written
+def write_atomic(file_name, data):
+    # Temporary file is created next to the target, so os.replace stays on the same filesystem
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+
+# This function returns the path to the user's database file
+def database_path(username):
+    return os.path.join("databases", username, username + ".database")
+
+
+# This function looks through the userlist and returns the password hash of the user
+def find_user_hash(user_name):
+    if not os.path.isfile("users.txt"):
+        return None
+    with open("users.txt", "rb") as f:
+        for line in f:
+            name, _, user_hash = line.decode("utf-8").rstrip("\r\n").partition(":")
+            if name == user_name:
+                return user_hash
+    return None
+
+
+# This function reads the lines of users.txt
+def read_user_lines():
+    if not os.path.isfile("users.txt"):
+        return []
+    with open("users.txt", "rb") as f:
+        return f.read().decode("utf-8").splitlines()
+
+
+# This function writes the lines to users.txt. All writers read the file right before it,
+# so the time between reading and replacing the file is as short as possible
+def write_user_lines(lines):
+    write_atomic("users.txt", "".join(line + "\n" for line in lines))
+
+
+# This function replaces the password hash of the user in users.txt with a fresh scrypt hash
+def upgrade_user_hash(user_name, password):
+    new_line = "{}:{}".format(user_name, hash_user_password(password))
+    lines = read_user_lines()
+    for i, line in enumerate(lines):
+        if line.partition(":")[0] == user_name:
+            lines[i] = new_line
+    write_user_lines(lines)
+
+
 # The log in menu
 def log_in():
     # User enters username and password
     user_name = input("User: ")
     user_pass = getpass.getpass("Password: ").encode("utf-8")
 
-    # Reading the userlist
-    if "users.txt" not in os.listdir(os.getcwd()):
-        return False, None, None
-
-    with open("users.txt", "rb") as f:
-        lines = f.read().decode("utf-8").splitlines()
-    users = {line.split(':')[0]: line.split(':')[1] for line in lines}
-
-    # If username is in the userlist
-    if user_name in users.keys():
-        # Calculates the password hash
-        pass_hash = get_hash(user_name.encode("utf-8")+user_pass)
-        # And checks if it equal to hash in the list
-        if users[user_name] == pass_hash:
-            return True, user_name, user_pass
-        else:
-            return False, None, None
+    # If username is in the userlist, checks the password against the hash in the list
+    user_hash = find_user_hash(user_name)
+    if user_hash is not None and check_user_password(user_name, user_pass, user_hash):
+        # Old unsalted sha256 hash is replaced with scrypt on the first successful log in
+        if not user_hash.startswith("scrypt$"):
+            upgrade_user_hash(user_name, user_pass)
+        return True, user_name, user_pass
     else:
         return False, None, None
 
@@ -56,12 +138,7 @@ def log_in():
 # User registration menu
 def reg_user():
     # Program reads list of users
-    if 'users.txt' not in os.listdir(os.getcwd()):
-        open("users.txt", "a")
-    with open("users.txt", "rb") as f:
-        text = f.read().decode("utf-8")
-    lines = text.splitlines()
-    users = [line.split(":")[0] for line in lines]
+    users = {line.partition(":")[0] for line in read_user_lines()}
 
     while 1:
         # User enters username and password
@@ -74,15 +151,20 @@ def reg_user():
             break
         else:
             # If it's not, program calculates the password hash
-            pswd_hash = get_hash(new_user.encode("utf-8") + new_password)
+            pswd_hash = hash_user_password(new_password)
 
-            # And write username and password hash to the file
-            out = "{}:{}\n".format(new_user, pswd_hash).encode("utf-8")
-            open("users.txt", "ab").write(out)
+            # And write username and password hash to the file. The list is read again,
+            # because another process could have changed it while the user was typing
+            lines = read_user_lines()
+            if new_user in {line.partition(":")[0] for line in lines}:
+                print("Username already exists")
+                break
+            lines.append("{}:{}".format(new_user, pswd_hash))
+            write_user_lines(lines)
 
             # Next program creates a folder for user database
-            os.makedirs(os.getcwd() + os.sep + "databases" + os.sep + new_user)
-            os.chdir(os.getcwd() + os.sep + "databases" + os.sep + new_user)
+            database_file = database_path(new_user)
+            os.makedirs(os.path.dirname(database_file), exist_ok=True)
 
             # After that program creates database file and encrypts it
             # First line of file contains username and user password
@@ -90,63 +172,77 @@ def reg_user():
             cipher = encryption.AESCipher(new_password)
             encrypted = cipher.encrypt(output)
 
-            open(new_user + ".database", "a")
-            with open(new_user + ".database", "w") as f:
-                f.write(encrypted)
-            os.chdir("..")
-            os.chdir("..")
+            write_atomic(database_file, encrypted)
             print("User successfully registered. Now you can log in")
             break
 
 # This function extracts passwords table from database
-def get_passwords(username, password):
-    os.chdir("databases" + os.sep + username)
+def get_passwords(username, cipher):
     # Function decrypts database
-    cipher = encryption.AESCipher(password)
-    with open(username + ".database", "r") as f:
+    with open(database_path(username), "r") as f:
         encrypted = f.read()
         text = cipher.decrypt(encrypted)
     if not text:
-        os.chdir("..")
         return None
 
     # Then from decrypted text it extracts line with login and password
-    text = text.splitlines()
-    passwords_table = {}
-    for line in text:
-        line = line.strip().split(':')
-        passwords_table[line[0]] = line[1]
-    os.chdir('..')
-    os.chdir('..')
+    passwords_table = dict(line.strip().split(':', 1) for line in text.splitlines())
     return passwords_table
 
 
-# This function creates new passwords database
-def db_append(username, password):
+# This function checks that login and password can be stored as one line of the database
+def is_valid_pair(login, password):
+    line = "{}:{}".format(login, password)
+    match = LOGIN_PASSWORD_PATTERN.fullmatch(line)
+    return match is not None and match.group("login") == login and line.splitlines() == [line]
 
-    # First function gets password list from database
-    passwords = get_passwords(username, password)
 
-    os.chdir("databases" + os.sep + username)
-    if username + ".database" not in os.listdir(os.getcwd()):
-        open(username + ".database", "a")
+# This function adds many login:password pairs to the database and saves it once.
+# Database is read again right before merging, so entries saved by another session are kept.
+# Logins which already exist are skipped. It returns the new table and the list of skipped logins.
+def add_passwords(username, cipher, pairs):
+    pairs = list(pairs)
+    for login, login_passwd in pairs:
+        if not is_valid_pair(login, login_passwd):
+            raise ValueError("Invalid login:password pair for login {!r}".format(login))
+
+    new_passwords = get_passwords(username, cipher) or {}
+    skipped = []
+    for login, login_passwd in pairs:
+        if login in new_passwords:
+            skipped.append(login)
+            continue
+        new_passwords[login] = login_passwd
+
+    # Program encrypts data and write it to the file
+    output = "".join("{}:{}\n".format(login, login_passwd) for login, login_passwd in new_passwords.items())
+    output = output.encode("utf-8")
+    write_atomic(database_path(username), cipher.encrypt(output))
+    return new_passwords, skipped
+
+
+# This function asks user for new passwords, adds them to the database and returns the new table
+def db_append(username, cipher):
+    # First function gets password list from database
+    passwords = get_passwords(username, cipher) or {}
+    new_passwords = {}
 
     # Next, the begins loop to input
-    print("Type data as following: login:password (no whitespaces and :)\n" +
+    print("Type data as following: login:password (at least 2 characters each, login without :,\n" +
+          "no whitespaces at the start or end of login and password)\n" +
           "Or type !end to stop\n")
     while 1:
         # User enters login:password
         db_create_command = input("@" + username + "(db_append)>")
-        pattern = re.compile("^.+\S:.+\S$")
-        match = pattern.fullmatch(db_create_command)
+        match = LOGIN_PASSWORD_PATTERN.fullmatch(db_create_command)
 
-        # If entered string matches to the pattern
-        if match:
-            db_create_command = db_create_command.split(":")
-            if db_create_command[0] in passwords.keys():
+        # If entered string matches to the pattern and can be stored as one line of the database
+        if match and is_valid_pair(match.group("login"), match.group("password")):
+            login = match.group("login")
+            if login in passwords or login in new_passwords:
                 print("\n!!!This login is already exists!!!\n")
                 continue
-            passwords[db_create_command[0]] = db_create_command[1]
+            new_passwords[login] = match.group("password")
         elif db_create_command == "!end":
             break
         elif db_create_command == "":
@@ -154,22 +250,22 @@ def db_append(username, password):
         else:
             print("\n!!!Unknown command!!!\n")
 
-    # When input finished, program encrypts data and write it to the file
-    output = ""
-    for login, login_passwd in zip(passwords.keys(), passwords.values()):
-        output += "{}:{}\n".format(login, login_passwd)
-    output = output.encode("utf-8")
-    cipher = encryption.AESCipher(password)
-    with open(username + ".database", "w") as f:
-        f.write(cipher.encrypt(output))
-    os.chdir("..")
-    os.chdir("..")
+    # When input finished, all new passwords are saved at once
+    passwords, skipped = add_passwords(username, cipher, new_passwords.items())
+    if skipped:
+        # Another session may have saved the same logins meanwhile
+        print("\n!!!These logins already exist and were not saved: {}!!!\n".format(", ".join(skipped)))
     print("\nBack to program...\n\nType !end to exit the program\n")
+    return passwords
 
 
 # This is main loop, it begins when user logs in
 def main_loop(current_username, current_user_password):
     print("Successfully logged in! Type !end to exit the program")
+    # Cipher key is derived once per session. Decrypted database is cached for read-only commands,
+    # add_password reads it again before saving
+    cipher = encryption.AESCipher(current_user_password)
+    passwords_table = get_passwords(current_username, cipher)
     while 1:
         main_cicle_command = input("@" + current_username + ">> ")
 
@@ -179,11 +275,10 @@ def main_loop(current_username, current_user_password):
 
         # This command allows user to add new passwords to the database
         elif main_cicle_command == "add_password":
-            db_append(current_username, current_user_password)
+            passwords_table = db_append(current_username, cipher)
 
         # This command allows user to extract password. Asked password copies to the clipboard, so user can paste it.
         elif main_cicle_command == "get_password":
-            passwords_table = get_passwords(current_username, current_user_password)
             if not passwords_table:
                 print("!!!Something went wrong. Database is corrupted or not exists!!!")
             login_from_db = input("Type login: ")
@@ -194,11 +289,9 @@ def main_loop(current_username, current_user_password):
                 print("No such login")
 
         elif main_cicle_command == "print_logins":
-            passwords_table = get_passwords(current_username, current_user_password)
             if not passwords_table:
                 print("!!!Something went wrong. Database is corrupted or not exists!!!")
-            for login in passwords_table.keys():
-                print(login)
+            sys.stdout.write("".join(login + "\n" for login in passwords_table))
 
         elif main_cicle_command == "help":
             print_help()
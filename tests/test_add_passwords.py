@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from main import add_passwords, db_append, get_passwords, write_atomic, database_path
+from encryption import AESCipher
+
+""" Тест функции add_passwords. Добавляем несколько паролей разом и читаем их обратно из базы.
+Проверяем, что неверные логины отклоняются, повторяющиеся пропускаются, а записи другой сессии не теряются"""
+
+class Test_add_passwords(unittest.TestCase):
+
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs("databases" + os.sep + "user")
+        self.cipher = AESCipher('1'.encode("utf-8"))
+        write_atomic(database_path('user'), self.cipher.encrypt(b""))
+        self.passwords, _ = add_passwords('user', self.cipher, [('mail', 'qwerty')])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def assertUnchanged(self):
+        self.assertEqual(self.passwords, {'mail': 'qwerty'})
+        self.assertEqual(get_passwords('user', self.cipher), self.passwords)
+
+    def test_add_passwords(self):
+        passwords, skipped = add_passwords('user', self.cipher, [('bank', 'asd:fgh'), ('shop', 'zxcvbn')])
+        self.assertEqual(passwords, {'mail': 'qwerty', 'bank': 'asd:fgh', 'shop': 'zxcvbn'})
+        self.assertEqual(skipped, [])
+        self.assertEqual(get_passwords('user', self.cipher), passwords)
+        self.assertEqual(self.passwords, {'mail': 'qwerty'})
+
+    def test_invalid_pairs(self):
+        for pair in [('ba\nnk', 'asdfgh'), ('ba:nk', 'asdfgh'), (' bank', 'asdfgh'),
+                     ('bank', 'asd\nfgh'), ('bank', 'asd\rfgh'), ('bank', 'asd\u2028fgh'),
+                     ('bank', 'asdfgh '), ('bank', '')]:
+            with self.assertRaises(ValueError):
+                add_passwords('user', self.cipher, [('shop', 'zxcvbn'), pair])
+            self.assertUnchanged()
+
+    def test_duplicate_logins(self):
+        passwords, skipped = add_passwords('user', self.cipher, [('mail', 'asdfgh'), ('bank', 'asdfgh'),
+                                                                 ('bank', 'zxcvbn')])
+        self.assertEqual(passwords, {'mail': 'qwerty', 'bank': 'asdfgh'})
+        self.assertEqual(skipped, ['mail', 'bank'])
+        self.assertEqual(get_passwords('user', self.cipher), passwords)
+
+    def test_failed_write(self):
+        with mock.patch("main.write_atomic", side_effect=OSError):
+            with self.assertRaises(OSError):
+                add_passwords('user', self.cipher, [('bank', 'asdfgh')])
+        self.assertUnchanged()
+
+    def test_db_append_keeps_entries_of_other_session(self):
+        commands = iter(['keep1:aaaa', 'bank2:yyyy', 'ab:c\u2028d', '!end'])
+
+        def enter(prompt):
+            command = next(commands)
+            if command == '!end':
+                # Another session of the same user saves its entries while this one is typing
+                add_passwords('user', self.cipher, [('other1', 'bbbb'), ('bank2', 'xxxx')])
+            return command
+
+        with mock.patch("builtins.input", side_effect=enter), \
+                mock.patch("builtins.print") as print_mock:
+            passwords = db_append('user', self.cipher)
+        self.assertEqual(passwords, {'mail': 'qwerty', 'other1': 'bbbb', 'bank2': 'xxxx', 'keep1': 'aaaa'})
+        self.assertEqual(get_passwords('user', self.cipher), passwords)
+        self.assertTrue(any('bank2' in str(call) for call in print_mock.call_args_list))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from main import hash_user_password, check_user_password, get_hash, find_user_hash, log_in, reg_user, \
+    read_user_lines, write_user_lines
+
+""" Тест хеширования пароля пользователя. Проверяем, что хеш соленый и что старые sha256 хеши принимаются"""
+
+class Test_password_hash(unittest.TestCase):
+
+
+    def test_check_password(self):
+        password = '1'.encode("utf-8")
+        pass_hash = hash_user_password(password)
+        self.assertTrue(check_user_password('user', password, pass_hash))
+        self.assertFalse(check_user_password('user', '2'.encode("utf-8"), pass_hash))
+
+    def test_salted(self):
+        password = '1'.encode("utf-8")
+        self.assertNotEqual(hash_user_password(password), hash_user_password(password))
+
+    def test_malformed_hash(self):
+        password = '1'.encode("utf-8")
+        for stored_hash in ['scrypt$', 'scrypt$abc', 'scrypt$zz$abc', 'scrypt$ab$cd$ef', 'scrypt$ab$\u00e9']:
+            self.assertFalse(check_user_password('user', password, stored_hash))
+
+    def test_legacy_hash(self):
+        password = '1'.encode("utf-8")
+        legacy_hash = get_hash('user'.encode("utf-8") + password)
+        self.assertTrue(check_user_password('user', password, legacy_hash))
+        self.assertFalse(check_user_password('user', '2'.encode("utf-8"), legacy_hash))
+
+    def test_legacy_hash_upgrade(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                legacy_hash = get_hash('user'.encode("utf-8") + '1'.encode("utf-8"))
+                with open("users.txt", "w") as f:
+                    f.write("other:abc\nuser:{}\n".format(legacy_hash))
+                with mock.patch("builtins.input", return_value='user'), \
+                        mock.patch("getpass.getpass", return_value='1'):
+                    self.assertEqual(log_in(), (True, 'user', '1'.encode("utf-8")))
+                new_hash = find_user_hash('user')
+                self.assertTrue(new_hash.startswith("scrypt$"))
+                self.assertTrue(check_user_password('user', '1'.encode("utf-8"), new_hash))
+                self.assertEqual(find_user_hash('other'), 'abc')
+            finally:
+                os.chdir(cwd)
+    def test_register_with_upgrade(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                legacy_hash = get_hash('user'.encode("utf-8") + '1'.encode("utf-8"))
+                write_user_lines(["user:{}".format(legacy_hash)])
+                with mock.patch("builtins.input", return_value='new'), \
+                        mock.patch("getpass.getpass", return_value='2'), mock.patch("builtins.print"):
+                    reg_user()
+                with mock.patch("builtins.input", return_value='user'), \
+                        mock.patch("getpass.getpass", return_value='1'):
+                    self.assertTrue(log_in()[0])
+                self.assertEqual([line.partition(":")[0] for line in read_user_lines()], ['user', 'new'])
+                self.assertTrue(check_user_password('new', '2'.encode("utf-8"), find_user_hash('new')))
+                self.assertTrue(check_user_password('user', '1'.encode("utf-8"), find_user_hash('user')))
+
+                # Another process registers the same name while the user is typing
+                def enter(prompt):
+                    write_user_lines(read_user_lines() + ["other:abc"])
+                    return 'other'
+                with mock.patch("builtins.input", side_effect=enter), \
+                        mock.patch("getpass.getpass", return_value='3'), mock.patch("builtins.print"):
+                    reg_user()
+                self.assertEqual(find_user_hash('other'), 'abc')
+                self.assertFalse(os.path.isdir(os.path.join("databases", "other")))
+            finally:
+                os.chdir(cwd)
+
+if __name__ == '__main__':
+    unittest.main()
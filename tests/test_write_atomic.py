@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from main import write_atomic
+
+""" Тест функции write_atomic. Проверяем запись файла и что при ошибке старый файл не портится, а временный удаляется"""
+
+class Test_write_atomic(unittest.TestCase):
+
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.tmp.name, "user.database")
+        with open(self.file_name, "w") as f:
+            f.write("old")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_write(self):
+        write_atomic(self.file_name, "new")
+        with open(self.file_name) as f:
+            self.assertEqual(f.read(), "new")
+        self.assertEqual(os.listdir(self.tmp.name), ["user.database"])
+
+    def test_failed_write(self):
+        with mock.patch("main.os.replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                write_atomic(self.file_name, "new")
+        with open(self.file_name) as f:
+            self.assertEqual(f.read(), "old")
+        self.assertEqual(os.listdir(self.tmp.name), ["user.database"])
+
+if __name__ == '__main__':
+    unittest.main()